@@ -32,6 +32,8 @@ See module mtspec for univariate problems
 # Import main libraries and modules
 #-----------------------------------------------------
 
+import os
+import collections
 import numpy as np
 import scipy
 from scipy import signal
@@ -40,6 +42,7 @@ import multitaper.utils      as utils
 import multitaper.mtspec     as spec
 import pandas as pd
 import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
 
 class MTCross:
 
@@ -824,7 +827,8 @@ class SineCross:
 
 def cross_spectrogram(
         data, dt, twin, olap=0.5, nw=3.5, kspec=5, fmin=0.0, fmax=-1.0,
-        iadapt=0, vn=None, lamb=None, wl=0.0,
+        iadapt=0, vn=None, lamb=None, wl=0.0, n_jobs=1, outfile=None,
+        nfft=0, dtype=np.complex64,
 ):
     """
     Computes a cross-spectrogram with consecutive crossspec estimates.
@@ -863,22 +867,36 @@ def cross_spectrogram(
         1 - Eigenvalue weights
         2 - Constant weighting
     wl : float, optional
-        water-level for stabilizing deconvolution (transfer function).
-        defined as proportion of mean power of Syy
+        Ignored, kept for compatibility. The water-level only affects
+        the transfer function, which is not part of the output.
+    n_jobs : int, optional
+        Number of worker processes used to compute the windows.
+        Default = 1 (serial). Negative values count from the number
+        of cores, -1 uses all, -2 all but one, etc. Cannot be 0.
+    outfile : str, optional
+        If given, the spectrogram is written block by block to this
+        .npy file, memory-mapped on disk, and the returned DataArray 
+        is backed by it. For long recordings that do not fit in RAM.
+        Default = None (in memory)
+    nfft : int, optional
+        Number of frequency points for the FFT of each segment.
+        Default = fast FFT length (scipy.fft.next_fast_len) of at
+        least 2*npts+1, with npts the number of points per segment.
+    dtype : complex dtype, optional
+        Data type of the returned spectrogram. 
+        Default = np.complex64, use np.complex128 for full precision.
 
 
     **Returns**
 
-    f : ndarray
-        Array of sample frequencies.
-    t : ndarray
-        Array of segment times.
-    Quad : ndarray
-        Spectrogram of x using the quadratic crossspec estimate.
-    MT : ndarray
-        Spectrogram of x using Thomson's crossspec estimate.
+    res : DataArray (f, t, var), dtype (default complex64)
+        f : Array of sample frequencies.
+        t : Array of segment times.
+        var : Sxx, Syy, Sxy, Syx and cohe estimates of each segment.
 
-    By default, the last axis of Quad/MT corresponds to the segment times.
+    Estimates are computed in double precision and by default stored
+    in single precision (complex64) to halve the memory of the 
+    spectrogram.
 
     **See Also**
 
@@ -925,7 +943,12 @@ def cross_spectrogram(
     nvars = 5
 
     if data_is_df:
-        tc = data.index[0] + pd.to_timedelta(t, unit='seconds')  # window middle datetime
+        # window middle datetime, from integer ns offsets converted
+        # to the resolution of the index (keeps index tz and unit)
+        toff = pd.to_timedelta(np.round(t * 1e9).astype('timedelta64[ns]'))
+        if hasattr(data.index, 'unit'):
+            toff = toff.as_unit(data.index.unit)
+        tc = data.index[0] + toff
         data = data.to_numpy()
     else:
         tc = t + twin // 2  # window middle times in seconds
@@ -934,53 +957,278 @@ def cross_spectrogram(
     print("Total number of cross-spectral estimates", nspec)
     print("Frequency band of interest (%5.2f-%5.2f)Hz" % (fmin, fmax))
 
-    if vn is None or lamb is None:
-        vn, lamb = utils.dpss(nwin, nw, kspec)
+    if kspec < 1:
+        kspec = int(np.round(2 * nw - 1))
+
+    if (vn is None or lamb is None
+            or np.shape(vn)[0] != nwin + 1 or np.shape(vn)[1] != kspec):
+        vn, lamb = utils._dpss_cached(nwin + 1, nw, kspec)
 
     if nspec == 0:
         return None
 
-    for i in range(nspec):
-        if (i + 1) % 10 == 0:
-            print("Loop ", i + 1, " of ", nspec)
-
-        i1 = nvec[i]
-        i2 = i1 + nwin
-
-        cross_psd = MTCross(
-            data[i1: i2 + 1, 0],  # x: independent/explanatory variable
-            data[i1: i2 + 1, 1],  # y: dependent/response variable
-            nw,
-            kspec,
-            dt,
-            iadapt=iadapt,
-            vn=vn,
-            lamb=lamb,
-            wl=wl,
-        )
-
-        freq2 = cross_psd.freq
-
-        if (i==0):
-            fres   = np.where((freq2>=fmin) & (freq2<=fmax))[0]
-            nf     = len(fres)
-            f      = freq2[fres]
-
-            res = xr.DataArray(
-                np.ones((nf, nspec, nvars), dtype=complex) * np.nan,
-                dims=('f', 't', 'var'),
-                coords=dict(f=f.flatten().astype(np.float64), t=tc, var=[
-                    'Sxx', 'Syy', 'Sxy', 'Syx', 'cohe'])
-            )
-
-        if np.isnan(data[i1: i2 + 1, :]).sum() > 0.1 * nwin:
-            for var in ['Sxx', 'Syy', 'Sxy', 'Syx', 'cohe']:
-                res.sel(var=var)[:, i] = (1+1j)*np.nan
+    #-----------------------------------------------------------------
+    # Frequency band. FFT padded to a fast length (small prime 
+    # factors) of at least 2*npts+1, the MTSpec default.
+    #-----------------------------------------------------------------
+
+    nfft  = int(nfft)
+    if nfft < nwin + 1:
+        nfft = scipy.fft.next_fast_len(2 * (nwin + 1) + 1, real=True)
+    freq2 = scipy.fft.rfftfreq(nfft, dt)
+    # freq2 is sorted, fres is a contiguous slice (no fancy indexing)
+    fres  = slice(np.searchsorted(freq2, fmin, side='left'),
+                  np.searchsorted(freq2, fmax, side='right'))
+    f     = freq2[fres]
+    nf    = len(f)
+
+    #-----------------------------------------------------------------
+    # Windows as a (nspec, 2, nwin+1) strided view (no copy), 
+    # estimated in blocks of windows. Blocks are sent to workers
+    # if requested.
+    #
+    # Windows with more than 10% NaN samples are rejected before
+    # any estimate and left as NaN. NaNs per window from the
+    # cumulative sum of NaNs per sample.
+    #-----------------------------------------------------------------
+
+    # x, y stored as contiguous rows, so each window of a variable 
+    # is a contiguous segment [2,npts]
+    data    = np.ascontiguousarray(np.transpose(data[:, :2]), dtype=float)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        data, nwin + 1, axis=1)[:, ::njump].transpose(1, 0, 2)
+
+    nan_cum   = np.concatenate(([0], np.cumsum(np.isnan(data).sum(axis=0))))
+    nan_count = nan_cum[nvec + nwin + 1] - nan_cum[nvec]
+    ivalid    = np.flatnonzero(nan_count <= 0.1 * nwin)
+    nvalid    = len(ivalid)
+
+    if n_jobs == 0:
+        raise ValueError("n_jobs cannot be 0")
+    if not np.issubdtype(dtype, np.complexfloating):
+        raise ValueError("dtype must be a complex type ", dtype)
+    if n_jobs < 0:
+        n_jobs = max(1, os.cpu_count() + 1 + n_jobs)
+    nblock = max(1, min(_block_size(nfft, kspec), -(-nvalid // n_jobs)))
+    blocks = [ivalid[i:i + nblock] for i in range(0, nvalid, nblock)]
+
+    #-----------------------------------------------------------------
+    # Output buffer, in memory or memory-mapped on disk. Stored
+    # window by window [nspec,nvars,nf], so each block is written
+    # to a contiguous region. Rejected windows are NaN.
+    #-----------------------------------------------------------------
+
+    if outfile is None:
+        buf = np.empty((nspec, nvars, nf), dtype=dtype)
+    else:
+        buf = np.lib.format.open_memmap(outfile, mode='w+', 
+                  dtype=dtype, shape=(nspec, nvars, nf))
+    buf[nan_count > 0.1 * nwin] = (1+1j)*np.nan
+
+    #-----------------------------------------------------------------
+    # Blocks are written as soon as they are estimated
+    #-----------------------------------------------------------------
+
+    pool = None
+    if n_jobs == 1 or nvalid == 0:
+        xtap    = np.zeros((nblock, 2, kspec, nfft), dtype=float)
+        results = (_cross_windows(windows[ib], vn, lamb, nfft, iadapt, fres,
+                                  workers=kspec, xtap=xtap) 
+                   for ib in blocks)
+    else:
+        # Data and tapers are sent once to each worker, blocks only
+        # carry window indices. At most 2*n_jobs blocks in flight.
+        pool    = ProcessPoolExecutor(max_workers=n_jobs, 
+                      initializer=_init_worker, 
+                      initargs=(data, nwin, njump, vn, lamb))
+        results = _pool_results(pool, blocks, nfft, iadapt, fres, 
+                                2 * n_jobs)
+
+    try:
+        for ib, (Sxx, Syy, Sxy, Syx, cohe) in zip(blocks, results):
+            buf[ib, 0, :] = Sxx
+            buf[ib, 1, :] = Syy
+            buf[ib, 2, :] = Sxy
+            buf[ib, 3, :] = Syx
+            buf[ib, 4, :] = cohe
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if outfile is not None:
+        buf.flush()
+
+    res = xr.DataArray(
+        np.transpose(buf, (2, 0, 1)),
+        dims=('f', 't', 'var'),
+        coords=dict(f=f.flatten().astype(np.float64), t=tc, var=[
+            'Sxx', 'Syy', 'Sxy', 'Syx', 'cohe'])
+    )
+
+    return res
+
+
+def _block_size(nfft, kspec):
+    """
+    Number of windows estimated at once in cross_spectrogram, keeping
+    each block of eigencoefficients (x and y) around 2**22 complex 
+    values.
+    """
 
-        else:
-            res.sel(var='Sxx')[:, i] = cross_psd.Sxx[fres, 0]
-            res.sel(var='Syy')[:, i] = cross_psd.Syy[fres, 0]
-            res.sel(var='Sxy')[:, i] = cross_psd.Sxy[fres, 0]
-            res.sel(var='cohe')[:, i] = cross_psd.cohe[fres, 0]
+    return max(1, int(2**22 // (2 * (nfft//2 + 1) * kspec)))
+
+
+_worker_data = None
+
+def _init_worker(data, nwin, njump, vn, lamb):
+    """
+    Initializer of the cross_spectrogram worker processes, keeps the
+    read-only data [2,npts], window parameters and tapers (vn, lamb)
+    for all the blocks of the worker.
+    """
+
+    global _worker_data
+    _worker_data = (data, nwin, njump, vn, lamb)
+
+
+def _cross_windows_worker(ib, nfft, iadapt, fres):
+    """
+    _cross_windows of the windows with indices ib, using the data 
+    and tapers stored by _init_worker.
+    """
+
+    data, nwin, njump, vn, lamb = _worker_data
+    windows = np.lib.stride_tricks.sliding_window_view(
+        data, nwin + 1, axis=1)[:, ::njump].transpose(1, 0, 2)
+
+    return _cross_windows(windows[ib], vn, lamb, nfft, iadapt, fres)
+
+
+def _pool_results(pool, blocks, nfft, iadapt, fres, nmax):
+    """
+    Results of _cross_windows_worker for each block, in order. At 
+    most nmax blocks are submitted and not yet consumed, so pending
+    inputs and results do not pile up in memory.
+    """
+
+    pending = collections.deque()
+    for ib in blocks:
+        pending.append(pool.submit(_cross_windows_worker, 
+                                   ib, nfft, iadapt, fres))
+        if len(pending) >= nmax:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _cross_windows(windows, vn, lamb, nfft, iadapt, fres, workers=1, 
+                   xtap=None):
+    """
+    Vectorized MTCross estimate of a stack of windows.
+
+    Same estimate as MTCross (and MTSpec for each variable) applied
+    to each window, but the nseg*nvars*kspec tapered segments are 
+    transformed with a single FFT call, and the eigencoefficients 
+    and adaptive weights of each variable are computed only once. 
+    Input signals are real, so only the non-negative frequencies 
+    are computed (rfft).
+
+    **Parameters**
+
+    windows : ndarray [nseg,2,npts]
+        x (explanatory) and y (response) segments of each window
+    vn : ndarray [npts,kspec]
+        Slepian sequences
+    lamb : ndarray [kspec]
+        Eigenvalues of DPSS
+    nfft : int
+        number of frequency points for FFT
+    iadapt : int
+        defines methos to use (see adaptspec)
+    fres : slice
+        frequency band to return
+    workers : int, optional
+        number of threads for the FFT, default = 1
+    xtap : ndarray [nblock,nvars,kspec,nfft], optional
+        zero-padded work buffer for the tapered segments, with 
+        nblock >= nseg. Can be reused between calls, only the 
+        first npts samples of each segment are overwritten.
+
+    **Returns**
+
+    Sxx, Syy, Sxy, Syx, cohe : ndarray [nseg,nf]
+        auto and cross spectra and coherence of each window
+
+    |
+
+    """
+
+    nseg, nvars, npts = np.shape(windows)
+    kspec = np.shape(vn)[1]
+
+    xv = windows - np.mean(windows, axis=2)[:, :, None]
+
+    if xtap is None:
+        xtap = np.zeros((nseg, nvars, kspec, nfft), dtype=float)
+    xtap = xtap[:nseg]
+    np.multiply(xv[:, :, None, :], vn.T[None, None, :, :], 
+                out=xtap[:, :, :, :npts])
+
+    # Eigencoefficients of all variables [nseg,nvars,nfft//2+1,kspec]
+    # FFT over the contiguous last axis of xtap (already padded)
+    yk = scipy.fft.rfft(xtap, axis=3, workers=workers)
+    yk = np.moveaxis(yk, 3, 2)
+    nf = np.shape(yk)[2]
+
+    wt = _adapt_weights(np.abs(yk.reshape(nseg*nvars, nf, kspec))**2,
+                        lamb, nfft, iadapt)
+    wt = np.min(wt.reshape(nseg, nvars, nf, kspec), axis=1)
+    wt = wt / np.sqrt(np.sum(np.abs(wt)**2, axis=2))[:, :, None]
+
+    # Weighted Yk's and cross-spectral matrix [nvars,nvars,nseg,nf]
+    dyk = wt[:, None, fres, :] * yk[:, :, fres, :]
+    S   = np.einsum('svfk,swfk->vwsf', dyk, np.conjugate(dyk))
+
+    Sxx  = np.real(S[0, 0])
+    Syy  = np.real(S[1, 1])
+    Sxy  = S[0, 1]
+    Syx  = S[1, 0]
+    cohe = np.abs(Sxy)**2 / (Sxx*Syy)
+
+    return Sxx, Syy, Sxy, Syx, cohe
+
+
+def _adapt_weights(sk, lamb, nfft, iadapt=0):
+    """
+    Weights of utils.adaptspec for a stack of eigenspectra sk 
+    [nseg,nfft//2+1,kspec] of real signals (non-negative frequencies
+    only). The adaptive iteration stops independently for each 
+    segment, as it would when calling adaptspec on each one.
+    """
+
+    nseg, nf, kspec = np.shape(sk)
+
+    if (iadapt==1):
+        return np.ones((nseg,nf,kspec), dtype=float)
+    if (iadapt==2):
+        return np.broadcast_to(lamb, (nseg,nf,kspec)).astype(float)
+
+    if (kspec < 2):
+        raise ValueError("Adaptive multitaper needs kspec >= 2 ", kspec)
+
+    df     = 1.0/float(nfft-1)
+
+    # Variance over all nfft frequencies, negative ones mirror the 
+    # positive ones (zero and Nyquist frequencies counted once)
+    varsk  = 2.0*np.sum(sk,axis=1) - sk[:,0,:]
+    if (nfft%2==0):
+        varsk = varsk - sk[:,-1,:]
+    varsk  = varsk*df
+    dvar   = np.mean(varsk,axis=1)
+    bk     = dvar[:,None] * (1.0-lamb)[None,:]
+
+    sbar, wt = utils.adaptwt(np.ascontiguousarray(sk, dtype=float),
+                             np.asarray(lamb, dtype=float), bk)
 
-    return res
\ No newline at end of file
+    return wt
@@ -28,6 +28,7 @@ import scipy
 import scipy.signal as signal
 import scipy.linalg as linalg
 import multitaper.utils as utils
+import pandas as pd
 import xarray as xr
 
 #-------------------------------------------------------------------------
@@ -979,7 +980,12 @@ def spectrogram(data,dt,twin,olap=0.5,nw=3.5,kspec=5,fmin=0.0,fmax=-1.0,iadapt=0
    nspec = len(nvec)
 
    if data_is_ser:
-      tc = data.index[0] + pd.to_timedelta(t, unit='seconds')  # window middle datetime
+      # window middle datetime, from integer ns offsets converted
+      # to the resolution of the index (keeps index tz and unit)
+      toff = pd.to_timedelta(np.round(t*1e9).astype('timedelta64[ns]'))
+      if hasattr(data.index, 'unit'):
+         toff = toff.as_unit(data.index.unit)
+      tc = data.index[0] + toff
       data = data.to_numpy()
    else:
       tc = t + twin // 2  # window middle times in seconds
@@ -988,36 +994,39 @@ def spectrogram(data,dt,twin,olap=0.5,nw=3.5,kspec=5,fmin=0.0,fmax=-1.0,iadapt=0
    print('Total number of spectral estimates', nspec)
    print('Frequency band of interest (%5.2f-%5.2f)Hz' %(fmin, fmax))
 
-   vn,theta = utils.dpss(nwin,nw,kspec)
-   for i in range(nspec):
-      if ((i+1)%10==0):
-         print('Loop ',i+1,' of ',nspec)
+   # Windows as (nspec,nwin+1) strided view, no copy
+   windows  = np.lib.stride_tricks.sliding_window_view(
+                  np.ravel(data),nwin+1)[::njump]
 
-      i1  = nvec[i]
-      i2  = i1+nwin
-      x   = data[i1:i2+1]
+   vn,theta = utils._dpss_cached(nwin+1,nw,kspec)
+   for i, x in enumerate(windows):
 
       psd = MTSpec(x,nw,kspec,dt,iadapt=iadapt,
                            vn=vn,lamb=theta)
 
-      freq2   = psd.freq
-      spec    = psd.spec 
-      qispec  = psd.qiinv()[0]   
-
-      nf         = len(freq2)
+      # 1D spectra, drop the singleton column once
+      freq2   = psd.freq[:,0]
+      spec    = psd.spec[:,0]
+      qispec  = psd.qiinv()[0][:,0]
 
       if (i==0):
-         fres   = np.where((freq2>=fmin) & (freq2<=fmax))[0]
-         nf     = len(fres)
+         # positive freqs are sorted, fres is a contiguous slice
+         fpos   = freq2[:psd.nf]
+         fres   = slice(np.searchsorted(fpos, fmin, side='left'),
+                        np.searchsorted(fpos, fmax, side='right'))
          f      = freq2[fres]
-         res = xr.DataArray(
-            np.ones((nf, nspec, 2), dtype=complex) * np.nan,
-            dims=('f', 't', 'var'),
-            coords=dict(f=f.flatten().astype(np.float64), t=tc, var=['Quad', 'MT'])
-         )
+         nf     = len(f)
+         # Stored window by window [nspec,2,nf], contiguous rows
+         buf    = np.empty((nspec, 2, nf), dtype=complex)
          print('Total frequency points %i' %(nf))
 
-      res.sel(var='Quad')[:, i] = qispec[fres,0]
-      res.sel(var='MT')[:, i]   = spec[fres,0]
+      buf[i,0,:] = qispec[fres]
+      buf[i,1,:] = spec[fres]
+
+   res = xr.DataArray(
+      np.transpose(buf, (2, 0, 1)),
+      dims=('f', 't', 'var'),
+      coords=dict(f=f.astype(np.float64), t=tc, var=['Quad', 'MT'])
+   )
    
    return res
@@ -40,6 +40,7 @@ import scipy.linalg as linalg
 import scipy.interpolate as interp
 import scipy.optimize as optim
 import os
+import functools
 from numba import njit
 
 
@@ -469,6 +470,25 @@ def dpss(npts,nw,kspec=None):
 # end DPSS 
 #-------------------------------------------------------------------------
 
+@functools.lru_cache(maxsize=16)
+def _dpss_cached(npts,nw,kspec=None):
+    """
+    Cached version of dpss, for codes that repeatedly need the same
+    tapers (e.g., spectrograms with a fixed window length).
+
+    The returned arrays are shared between calls, and are therefore
+    set to read-only.
+
+    |
+
+    """
+
+    vn, lamb = dpss(npts,nw,kspec)
+    vn.flags.writeable   = False
+    lamb.flags.writeable = False
+
+    return vn, lamb
+
 def dpss2(npts,nw,nev=None):
     """
     This is a try to compute the DPSS using the original Thomson
@@ -778,9 +798,11 @@ def adaptspec(yk,sk,lamb,iadapt=0):
 
     February 2022. Now calculating adapt weights without for loop. 
 
+    The adaptive iteration is done in adaptwt (numba). 
+
     **Calls**
     
-    nothing
+    adaptwt
 
     |
 
@@ -848,50 +870,19 @@ def adaptspec(yk,sk,lamb,iadapt=0):
     dvar   = np.mean(varsk)
 
     bk	   = dvar  * lamb1  # Eq 5.1b Thomson
-    sqlamb = np.sqrt(lamb)
 
     #-------------------------------------------------
     # Iterate to find optimal spectrum
     #-------------------------------------------------
 
-    rerr = 9.5e-7	# Value used in F90 codes check
-
-    sbar = (sk[:,0] + sk[:,1])/2.0
-    spec = sbar[:,None]
-    
-    for i in range(mloop):
-    
-        slast = np.copy(sbar)
-
-#        for k in range(kspec):
-#            wt[:,k]  = sqlamb[k]*sbar /(lamb[k]*sbar + bk[k])
-#            wt[:,k]  = np.minimum(wt[:,k],1.0)
-#            skw[:,k] = wt[:,k]**2 * sk[:,k]   
-#
-#        wtsum     = np.sum(wt**2,axis=1)
-#        skwsum    = np.sum(skw,axis=1)
-#        sbar      = skwsum / wtsum
-
-        wt1     = sqlamb[None,:]*sbar[:,None]
-        wt2     = (lamb[None,:]*sbar[:,None]+bk[None,:])
-        wt      = np.minimum(wt1/wt2,1.0)
-        skw     = wt**2 * sk   
-        wtsum   = np.sum(wt**2,axis=1)
-        skwsum  = np.sum(skw,axis=1)
-        sbar    = skwsum / wtsum
-
-        oerr = np.max(np.abs((sbar-slast)/(sbar+slast)))
-
-        if (i==mloop): 
-            spec = sbar[:,None]
-            print('adaptspec did not converge, rerr = ',oerr, rerr)
-            break
-        
-        if (oerr > rerr):
-            continue
+    if (kspec < 2):
+        raise ValueError("Adaptive multitaper needs kspec >= 2 ", kspec)
 
-        spec = sbar[:,None]
-        break
+    sk     = np.ascontiguousarray(sk,dtype=float)
+    sbar, wt = adaptwt(sk[None,:,:],np.asarray(lamb,dtype=float),
+                       bk[None,:],mloop)
+    sbar   = sbar[0]
+    wt     = wt[0]
 
     spec = sbar[:,None]
     #---------
@@ -909,6 +900,86 @@ def adaptspec(yk,sk,lamb,iadapt=0):
 # end adaptspec 
 #-------------------------------------------------------------------------
 
+#-------------------------------------------------------------------------
+# Adaptwt - adaptive weights iteration
+#-------------------------------------------------------------------------
+
+@njit(cache=True)
+def adaptwt(sk,lamb,bk,mloop=1000):
+    """
+    Iteration for the adaptive weights of Thomson (1982), for a 
+    stack of nseg eigenspectra. Used by adaptspec.
+    Needs kspec >= 2 (checked by the callers, njit does no bounds
+    checking).
+    
+    Each segment iterates until its own convergence, as if adaptspec
+    was called on each one. A segment with NaN values is considered
+    converged (like np.max in previous versions).
+
+    **Parameters**
+
+    sk : ndarray [nseg,nf,kspec]
+        eigenspectra of each segment
+    lamb : ndarray [kspec]
+        eigenvalues of tapers
+    bk : ndarray [nseg,kspec]
+        broad-band bias of each eigenspectrum, variance*(1-lamb)
+    mloop : int
+        maximum number of iterations
+
+    **Returns**
+
+    sbar : ndarray [nseg,nf]
+        adaptively weighted spectrum (not scaled)
+    wt : ndarray [nseg,nf,kspec]
+        adaptive weights
+
+    """
+
+    rerr = 9.5e-7	# Value used in F90 codes check
+
+    nseg   = sk.shape[0]
+    nf     = sk.shape[1]
+    kspec  = sk.shape[2]
+    sqlamb = np.sqrt(lamb)
+
+    sbar  = np.zeros((nseg,nf))
+    wt    = np.zeros((nseg,nf,kspec))
+    snew  = np.zeros(nf)
+
+    for j in range(nseg):
+
+        for m in range(nf):
+            sbar[j,m] = (sk[j,m,0] + sk[j,m,1])/2.0
+
+        for i in range(mloop):
+            oerr = 0.0
+            for m in range(nf):
+                wtsum  = 0.0
+                skwsum = 0.0
+                for k in range(kspec):
+                    w = sqlamb[k]*sbar[j,m]/(lamb[k]*sbar[j,m] + bk[j,k])
+                    if (w > 1.0):
+                        w = 1.0
+                    wt[j,m,k] = w
+                    wtsum     = wtsum + w**2
+                    skwsum    = skwsum + w**2 * sk[j,m,k]
+                snew[m] = skwsum / wtsum
+                err     = abs((snew[m]-sbar[j,m])/(snew[m]+sbar[j,m]))
+                if (err > oerr or err != err):
+                    oerr = err
+            for m in range(nf):
+                sbar[j,m] = snew[m]
+
+            if (not oerr > rerr):
+                break
+
+    return sbar, wt
+
+#-------------------------------------------------------------------------
+# end adaptwt 
+#-------------------------------------------------------------------------
+
 #-------------------------------------------------------------------------
 # jackspec
 #-------------------------------------------------------------------------